@@ -1,9 +1,27 @@
 import cv2
+import glob
 import os
+import shutil
+import numpy as np
 from insightface.app import FaceAnalysis
+from insightface.app.common import Face
+from insightface.utils import face_align
 from insightface import model_zoo
-from threading import Thread
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import shared_memory
+from threading import Event, Lock, Thread
 import logging
+import logging.handlers
+import multiprocessing as mp
+import queue
+import onnxruntime
+import trt_engine
+
+# Numba为可选依赖，未安装时使用NumPy实现的融合
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
 
 # 配置日志系统，设置日志级别为INFO，这样会显示INFO及以上级别的日志信息1.人脸检测与识别
 # `insightface`库的`buffalo模型进行高精度人脸检测和特征提取
@@ -13,6 +31,266 @@ import logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+
+class ThrottleFilter(logging.Filter):
+    """
+    日志限流过滤器，相同内容的日志在指定间隔内只输出一次
+    
+    换脸每帧都会执行，“模型仍在加载中...”“目标图片中未检测到人脸”等日志
+    不限流时每秒会输出几十次
+    """
+
+    def __init__(self, interval=1.0):
+        """
+        参数：
+        - interval: 相同日志的最小输出间隔（秒）
+        """
+        super().__init__()
+        self.interval = interval
+        self.last_emit = {}  # 日志内容 -> 上次输出时间
+
+    def filter(self, record):
+        key = (record.levelno, record.getMessage())
+        now = record.created
+        if now - self.last_emit.get(key, 0) < self.interval:
+            return False
+        self.last_emit[key] = now
+        return True
+
+
+logger.addFilter(ThrottleFilter())
+
+# ONNX Runtime执行提供者，显式指定CUDA优先，避免静默回退到CPU
+PROVIDERS = ['CUDAExecutionProvider', 'CPUExecutionProvider']
+# 换脸模型每帧都要推理，使用穷举搜索选择最快的cuDNN卷积算法
+SWAPPER_PROVIDERS = [
+    ('CUDAExecutionProvider', {'device_id': 0, 'cudnn_conv_algo_search': 'EXHAUSTIVE'}),
+    'CPUExecutionProvider',
+]
+# 需要加载的buffalo_l子模块
+FACE_MODULES = ['detection', 'recognition']
+# 人脸检测输入尺寸，摄像头画面先缩小到该尺寸再检测
+DET_SIZE = (320, 320)
+# 与换脸子进程共享的帧缓冲区大小，最大支持1920x1080画面
+FRAME_SHM_SIZE = 1920 * 1080 * 3
+# 等待子进程处理一帧的超时时间（秒）
+SWAP_TIMEOUT = 5.0
+# 等待子进程时检查取消请求的间隔（秒）
+SWAP_POLL_INTERVAL = 0.05
+# INT8量化校准所需的样本数，收集满后在下次启动时构建INT8引擎
+CALIB_SAMPLES = 500
+# 每隔多少帧运行一次完整检测，其余帧用光流跟踪关键点
+DET_INTERVAL = 5
+# 光流前向-后向跟踪误差阈值（缩小后图像上的像素），超过时认为关键点漂移
+TRACK_FB_THRESHOLD = 1.0
+# 优化后ONNX模型的缓存目录，不能放在模型目录中
+ORT_CACHE_DIR = os.path.expanduser('~/.insightface/cache')
+# ONNX张量类型到NumPy类型的映射，用于预分配输出缓冲区
+ORT_TYPES = {
+    'tensor(float)': np.float32,
+    'tensor(float16)': np.float16,
+}
+
+
+def _blend_numpy(dst, warped, mask):
+    """
+    按软遮罩将换脸结果融合到目标区域（NumPy实现）
+    
+    参数：
+    - dst: 目标区域，uint8，原地修改
+    - warped: 变换回原图坐标的换脸结果，uint8
+    - mask: 0~1的软遮罩，float32
+    """
+    m = mask[:, :, None]
+    dst[:] = (m * warped + (1 - m) * dst).astype(np.uint8)
+
+
+if njit is not None:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _blend(dst, warped, mask):
+        """
+        按软遮罩将换脸结果融合到目标区域（Numba实现，逐行并行，参数同_blend_numpy）
+        """
+        for i in prange(dst.shape[0]):
+            for j in range(dst.shape[1]):
+                m = mask[i, j]
+                if m > 0:
+                    for c in range(3):
+                        dst[i, j, c] = np.uint8(m * warped[i, j, c] + (1.0 - m) * dst[i, j, c])
+else:
+    _blend = _blend_numpy
+
+
+def _optimized_model_prefix(model_file):
+    """
+    计算优化后模型缓存文件名的公共前缀
+    
+    参数：
+    - model_file: ONNX模型路径
+    
+    返回：
+    - ORT_CACHE_DIR下的路径前缀，加上所在目录名，避免不同模型包中的同名模型冲突
+    """
+    model_dir, model_name = os.path.split(os.path.splitext(model_file)[0])
+    return os.path.join(ORT_CACHE_DIR, f"{os.path.basename(model_dir)}_{model_name}")
+
+
+def _optimized_model_path(model_file, provider):
+    """
+    计算优化后模型的缓存路径
+    
+    参数：
+    - model_file: ONNX模型路径
+    - provider: 会话实际使用的第一个执行提供者
+    
+    返回：
+    - ORT_CACHE_DIR下的缓存文件路径
+    
+    优化后的图中包含分配给具体执行提供者的融合节点，不同提供者之间不能共用，
+    因此文件名中包含执行提供者；同时包含源模型的大小和修改时间，模型被替换后缓存自动失效。
+    缓存不能放在模型目录中，FaceAnalysis会把该目录下所有.onnx文件都当作模型加载。
+    """
+    st = os.stat(model_file)
+    return f"{_optimized_model_prefix(model_file)}.{st.st_size}_{st.st_mtime_ns}.{provider}.opt.onnx"
+
+
+def create_session(model_file, providers):
+    """
+    创建开启图优化的推理会话，并缓存优化后的模型
+    
+    参数：
+    - model_file: ONNX模型路径
+    - providers: 执行提供者列表
+    
+    返回：
+    - onnxruntime.InferenceSession对象
+    
+    首次运行时将扩展级别优化后的模型保存到ORT_CACHE_DIR，之后直接加载该文件，
+    只需再执行布局优化。保存时不使用ORT_ENABLE_ALL，布局优化的结果与当前CPU绑定。
+    
+    请求的执行提供者可能初始化失败（例如缺少cuDNN时CUDA回退到CPU），
+    因此缓存按会话实际使用的执行提供者命名：加载缓存后实际提供者与文件名不一致时，
+    放弃该会话并从源模型重新优化。
+    """
+    def session_options():
+        so = onnxruntime.SessionOptions()
+        so.enable_mem_pattern = True
+        # CPU回退时限制线程数，避免多个会话并行推理时线程池相互争抢
+        so.intra_op_num_threads = max(1, (os.cpu_count() or 2) // 2)
+        so.inter_op_num_threads = 1
+        return so
+
+    prefix = _optimized_model_prefix(model_file)
+    st = os.stat(model_file)
+    key = f"{st.st_size}_{st.st_mtime_ns}"
+    # 删除源模型被替换之前的缓存
+    for cached in glob.glob(glob.escape(prefix) + '.*.opt.onnx'):
+        if not cached.startswith(f"{prefix}.{key}."):
+            os.remove(cached)
+
+    names = [p[0] if isinstance(p, tuple) else p for p in providers]
+    for provider in names:
+        opt_file = _optimized_model_path(model_file, provider)
+        if not os.path.exists(opt_file):
+            continue
+        so = session_options()
+        so.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        session = onnxruntime.InferenceSession(opt_file, sess_options=so, providers=providers)
+        if session.get_providers()[0] == provider:
+            return session
+        break
+
+    os.makedirs(ORT_CACHE_DIR, exist_ok=True)
+    tmp_file = f"{prefix}.{key}.tmp"
+    so = session_options()
+    so.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+    so.optimized_model_filepath = tmp_file
+    session = onnxruntime.InferenceSession(model_file, sess_options=so, providers=providers)
+    if os.path.exists(tmp_file):
+        os.replace(tmp_file, _optimized_model_path(model_file, session.get_providers()[0]))
+    return session
+
+
+class IOBindingSession:
+    """
+    基于IOBinding的推理会话包装类
+    
+    提供与InferenceSession相同的run接口，可以直接替换insightface模型的session属性
+    
+    主要功能：
+    1. 输入绑定到预分配的CUDA缓冲区，每帧原地更新，不再重复申请显存
+    2. 形状固定的输出绑定到预分配的CUDA缓冲区，其余输出由ORT在显存中分配
+    3. 推理过程加锁，可以被多个线程安全调用
+    """
+
+    def __init__(self, session, device_id=0):
+        """
+        参数：
+        - session: 已启用CUDAExecutionProvider的InferenceSession
+        - device_id: GPU设备ID
+        """
+        self.session = session
+        self.device_id = device_id
+        self.io = session.io_binding()
+        # IOBinding和预分配缓冲区不能被多个线程同时使用
+        self.lock = Lock()
+        self.inputs = {}  # 输入名称 -> CUDA上的OrtValue
+        self.outputs = {}  # 输出名称 -> CUDA上的OrtValue
+        self.output_names = [out.name for out in session.get_outputs()]
+        for out in session.get_outputs():
+            static = all(isinstance(d, int) and d > 0 for d in out.shape)
+            if static and out.type in ORT_TYPES:
+                ort_value = onnxruntime.OrtValue.ortvalue_from_shape_and_type(
+                    out.shape, ORT_TYPES[out.type], 'cuda', device_id)
+                self.io.bind_ortvalue_output(out.name, ort_value)
+                self.outputs[out.name] = ort_value
+            else:
+                self.io.bind_output(out.name, 'cuda', device_id)
+
+    def get_inputs(self):
+        return self.session.get_inputs()
+
+    def get_outputs(self):
+        return self.session.get_outputs()
+
+    def get_providers(self):
+        return self.session.get_providers()
+
+    def run(self, output_names, input_feed):
+        """
+        执行一次推理
+        
+        参数：
+        - output_names: 需要返回的输出名称列表，为None时返回全部输出
+        - input_feed: 输入名称到ndarray的字典
+        
+        返回：
+        - 与output_names顺序一致的输出ndarray列表
+        """
+        with self.lock:
+            for name, value in input_feed.items():
+                value = np.ascontiguousarray(value)
+                ort_value = self.inputs.get(name)
+                if ort_value is None or ort_value.shape() != list(value.shape):
+                    # 首次调用或输入形状变化时重新分配
+                    ort_value = onnxruntime.OrtValue.ortvalue_from_numpy(value, 'cuda', self.device_id)
+                    self.inputs[name] = ort_value
+                    self.io.bind_ortvalue_input(name, ort_value)
+                else:
+                    ort_value.update_inplace(value)
+            self.session.run_with_iobinding(self.io)
+            outputs = dict(zip(self.output_names, self.io.copy_outputs_to_cpu()))
+        return [outputs[name] for name in (output_names or self.output_names)]
+
+
+def bind_session(session):
+    """
+    会话启用了CUDA时包装为IOBindingSession，否则原样返回
+    """
+    if 'CUDAExecutionProvider' in session.get_providers():
+        return IOBindingSession(session)
+    return session
+
 class FaceSwapper:
     """
     人脸交换类，负责加载模型和执行人脸交换操作
@@ -31,14 +309,48 @@ class FaceSwapper:
         - app: FaceAnalysis对象，用于人脸检测
         - swapper: 换脸模型对象
         - thread: 用于异步加载模型的线程
+        - _src_cache: (源图片, 源人脸)缓存，源图片不变时跳过检测和特征提取
+        - _last_face/_last_gray/_frames_since_det: 目标人脸的帧间跟踪状态
+        - _calib_dir/_calib_count: TensorRT INT8校准样本的收集状态
+        - executor: 源图片更换时，与目标画面检测并行处理源图片的线程池，
+          同时负责写入校准样本
         """
         self.app = None  # 人脸检测模型
         self.swapper = None  # 换脸模型
+        self._src_cache = (None, None)
+        # 目标人脸跟踪状态：上一帧人脸、上一帧缩小后的灰度图、距上次检测的帧数
+        self._last_face = None
+        self._last_gray = None
+        self._frames_since_det = 0
+        # 检测用缩小图和灰度图的复用缓冲区，尺寸变化时由OpenCV重新分配
+        self._small_buf = None
+        self._gray_buf = None
+        # INT8校准样本目录和已收集的样本数，在_load_models中初始化
+        self._calib_dir = None
+        self._calib_count = CALIB_SAMPLES
+        # 另一路检测在调用线程中执行，一个工作线程即可
+        self.executor = ThreadPoolExecutor(max_workers=1)
         # 创建并启动一个守护线程来加载模型，这样不会阻塞主线程
         self.thread = Thread(target=self._load_models)
         self.thread.daemon = True  # 设置为守护线程，主线程结束时自动退出
         self.thread.start()
 
+    def is_loading(self):
+        """
+        模型是否仍在加载中
+        """
+        return self.thread.is_alive()
+
+    def cancel(self):
+        """
+        与SwapProcess.cancel接口保持一致，同步执行的换脸无法中途取消
+        """
+
+    def reset(self):
+        """
+        与SwapProcess.reset接口保持一致
+        """
+
     def _load_models(self):
         """
         异步加载所需模型
@@ -46,15 +358,23 @@ class FaceSwapper:
         加载过程：
         1. 加载人脸检测模型（buffalo_l）
         2. 检查并加载换脸模型（inswapper_128.onnx）
+        3. 用合成图片预热所有模型
         
         如果加载失败，会记录错误日志并设置模型为None
         """
         try:
             # 加载人脸检测模型
             logger.info("开始加载人脸检测模型...")
-            self.app = FaceAnalysis(name='buffalo_l')  # 使用buffalo_l模型进行人脸检测
+            # 使用buffalo_l模型进行人脸检测，换脸只需要检测（含5点关键点）和识别（特征向量），
+            # 不加载106点/68点关键点和性别年龄模型，减少每帧的推理次数
+            self.app = FaceAnalysis(name='buffalo_l', allowed_modules=FACE_MODULES, providers=PROVIDERS)
+            logger.info(f"已加载人脸分析模块: {list(self.app.models.keys())}")
             # 准备模型，设置GPU设备ID和检测尺寸
-            self.app.prepare(ctx_id=0, det_size=(320, 320))
+            self.app.prepare(ctx_id=0, det_size=DET_SIZE)
+            # 各子模型每帧都要推理，重建为统一配置（图优化、线程数、IOBinding）的会话
+            for taskname, model in self.app.models.items():
+                model.session = bind_session(create_session(model.model_file, PROVIDERS))
+                self._check_providers(taskname, model.session)
             logger.info("人脸检测模型加载完成")
 
             # 检查换脸模型文件是否存在
@@ -66,12 +386,404 @@ class FaceSwapper:
             # 加载换脸模型
             logger.info("开始加载换脸模型...")
             self.swapper = model_zoo.get_model(model_path)  # 加载inswapper_128模型
+            # 重建推理会话，为CUDA执行提供者指定设备和卷积算法搜索策略，并开启图优化和IOBinding
+            self.swapper.session = bind_session(create_session(model_path, SWAPPER_PROVIDERS))
+            self._check_providers('swapper', self.swapper.session)
+            # 优先使用TensorRT引擎替换ONNX Runtime会话
+            self._load_trt_engine(model_path)
             logger.info("换脸模型加载完成")
+
+            # 预热完成后加载线程才结束，界面随后才会开始换脸
+            self._warm_up()
         except Exception as e:
             logger.error(f"模型加载失败: {str(e)}")
             self.app = None
             self.swapper = None
 
+    def _warm_up(self):
+        """
+        用合成图片执行一次完整的检测和换脸流程
+        
+        首次推理需要完成cuDNN/cuBLAS算法搜索（EXHAUSTIVE模式下耗时数百毫秒）和
+        Numba编译，在加载阶段提前完成，避免第一帧画面卡顿。
+        预热失败不影响使用，只记录警告。
+        """
+        logger.info("开始预热模型...")
+        try:
+            dummy = np.zeros((256, 256, 3), np.uint8)
+            # 纯黑图片检测不到人脸，但检测模型的推理仍会执行
+            self.app.get(dummy)
+
+            # 按ArcFace标准关键点构造位于图片中央的合成人脸，预热其余子模型和换脸模型
+            kps = face_align.arcface_dst * 2 + 16
+            bbox = np.array([kps[:, 0].min() - 20, kps[:, 1].min() - 40,
+                             kps[:, 0].max() + 20, kps[:, 1].max() + 40], np.float32)
+            face = Face(bbox=bbox, kps=kps, det_score=1.0)
+            for taskname, model in self.app.models.items():
+                if taskname != 'detection':
+                    model.get(dummy, face)
+            if face.embedding is None:
+                face.embedding = np.ones(512, np.float32)
+            bgr_fake, M = self.swapper.get(dummy, face, face, paste_back=False)
+            self._paste_back(dummy, bgr_fake, M)
+            logger.info("模型预热完成")
+        except Exception as e:
+            logger.warning(f"模型预热失败: {str(e)}")
+
+    def _check_providers(self, name, session):
+        """
+        记录推理会话实际使用的执行提供者
+        
+        参数：
+        - name: 模型名称，用于日志显示
+        - session: 推理会话对象
+        
+        CUDA未生效时（如onnxruntime-gpu与CUDA版本不匹配）输出警告，尽早暴露配置问题
+        """
+        providers = session.get_providers()
+        logger.info(f"{name} 执行提供者: {providers}")
+        if 'CUDAExecutionProvider' not in providers:
+            logger.warning(f"{name} 未启用CUDAExecutionProvider，将在CPU上推理")
+
+    def _load_trt_engine(self, model_path):
+        """
+        为换脸模型加载TensorRT引擎
+        
+        参数：
+        - model_path: inswapper_128.onnx的路径
+        
+        引擎缓存在模型同目录下，文件名包含TensorRT版本和GPU型号（见trt_engine.engine_tag），
+        不存在时先构建，按以下顺序选择：
+        1. INT8引擎（inswapper_128.<tag>.int8.engine），需要已收集足够的校准样本
+        2. FP16引擎（inswapper_128.<tag>.fp16.engine）
+        3. 以上都失败时保留ONNX Runtime会话
+        
+        只替换推理会话，人脸对齐仍由insightface完成。
+        INT8校准样本不足时，在换脸过程中自动收集对齐后的人脸。
+        INT8构建成功后校准结果保存在inswapper_128.int8.cache中，样本随即删除；
+        构建失败时写入.failed标记，之后不再尝试构建INT8引擎（构建耗时数分钟）
+        """
+        if not trt_engine.is_available():
+            logger.info("未检测到TensorRT，使用ONNX Runtime推理")
+            return
+
+        base_path = os.path.splitext(model_path)[0]
+        try:
+            engine_base = f"{base_path}.{trt_engine.engine_tag()}"
+        except Exception as e:
+            logger.warning(f"获取GPU信息失败: {str(e)}")
+            logger.warning("回退到ONNX Runtime推理")
+            return
+        int8_path = engine_base + '.int8.engine'
+        int8_failed = int8_path + '.failed'
+        calib_cache = base_path + '.int8.cache'
+        self._calib_dir = base_path + '_calib'
+        calib_files = sorted(glob.glob(os.path.join(self._calib_dir, '*.npz')))
+        self._calib_count = len(calib_files)
+
+        candidates = [(engine_base + '.fp16.engine', None)]
+        if os.path.exists(int8_failed):
+            logger.info("INT8引擎曾构建失败，使用FP16引擎")
+            self._calib_count = CALIB_SAMPLES
+        elif (os.path.exists(int8_path) or os.path.exists(calib_cache)
+              or self._calib_count >= CALIB_SAMPLES):
+            calibrator = trt_engine.Int8Calibrator(calib_files, calib_cache)
+            candidates.insert(0, (int8_path, calibrator))
+        else:
+            logger.info(f"INT8校准样本 {self._calib_count}/{CALIB_SAMPLES}，暂时使用FP16引擎")
+
+        for engine_path, calibrator in candidates:
+            precision = 'INT8' if calibrator is not None else 'FP16'
+            try:
+                # INSwapper.get通过session.run推理，直接替换session即可
+                self.swapper.session = self._open_trt_engine(model_path, engine_path, calibrator)
+                logger.info(f"TensorRT {precision}引擎加载完成")
+                if calibrator is not None:
+                    self._calib_count = CALIB_SAMPLES  # 已有INT8引擎，停止收集样本
+                    self._remove_calibration_samples()
+                return
+            except Exception as e:
+                logger.warning(f"TensorRT {precision}引擎加载失败: {str(e)}")
+                if calibrator is not None:
+                    # 记录失败，避免每次启动都重新执行耗时的INT8构建
+                    open(int8_failed, 'w').close()
+                    self._calib_count = CALIB_SAMPLES
+                    self._remove_calibration_samples()
+        logger.warning("回退到ONNX Runtime推理")
+
+    def _remove_calibration_samples(self):
+        """
+        删除INT8校准样本（对齐后的人脸图片，约100MB）
+        
+        校准结果已缓存或已放弃INT8时样本不再需要
+        """
+        if os.path.isdir(self._calib_dir):
+            shutil.rmtree(self._calib_dir, ignore_errors=True)
+            logger.info(f"已删除INT8校准样本: {self._calib_dir}")
+
+    def _open_trt_engine(self, model_path, engine_path, calibrator):
+        """
+        加载TensorRT引擎，引擎不存在时先构建
+        
+        参数：
+        - model_path: inswapper_128.onnx的路径
+        - engine_path: 引擎缓存路径
+        - calibrator: INT8校准器，构建FP16引擎时为None
+        
+        返回：
+        - TRTSession对象
+        
+        已有的引擎文件反序列化失败时（文件损坏或不完整），删除后重新构建一次
+        """
+        precision = 'INT8' if calibrator is not None else 'FP16'
+        if os.path.exists(engine_path):
+            try:
+                return trt_engine.TRTSession(engine_path)
+            except Exception as e:
+                logger.warning(f"TensorRT {precision}引擎无法加载，将重新构建: {str(e)}")
+                os.remove(engine_path)
+        logger.info(f"开始构建TensorRT {precision}引擎（仅首次运行，耗时较长）...")
+        trt_engine.build_engine(model_path, engine_path, calibrator)
+        return trt_engine.TRTSession(engine_path)
+
+    def _collect_calibration_sample(self, img, face, src_face):
+        """
+        收集一个INT8校准样本
+        
+        参数：
+        - img: 包含目标人脸的图片
+        - face: 目标人脸（使用kps对齐）
+        - src_face: 源人脸（使用normed_embedding）
+        
+        按INSwapper.get相同的预处理生成两个模型输入，交给线程池写入校准目录
+        """
+        if self._calib_count >= CALIB_SAMPLES:
+            return
+        swapper = self.swapper
+        aimg, _ = face_align.norm_crop2(img, face.kps, swapper.input_size[0])
+        blob = cv2.dnn.blobFromImage(aimg, 1.0 / swapper.input_std, swapper.input_size,
+                                     (swapper.input_mean, swapper.input_mean, swapper.input_mean),
+                                     swapRB=True)
+        latent = np.dot(src_face.normed_embedding.reshape((1, -1)), swapper.emap)
+        latent /= np.linalg.norm(latent)
+        sample = {swapper.input_names[0]: blob, swapper.input_names[1]: latent.astype(np.float32)}
+        self.executor.submit(self._write_calibration_sample, sample)
+
+    def _write_calibration_sample(self, sample):
+        """
+        将校准样本写入磁盘，只在线程池中执行，保证编号不重复
+        """
+        if self._calib_count >= CALIB_SAMPLES:
+            return
+        os.makedirs(self._calib_dir, exist_ok=True)
+        path = os.path.join(self._calib_dir, f"{self._calib_count:04d}.npz")
+        np.savez(path, **sample)
+        self._calib_count += 1
+        if self._calib_count == CALIB_SAMPLES:
+            logger.info("INT8校准样本收集完成，下次启动时将构建INT8引擎")
+
+    def _get_source_face(self, src_img):
+        """
+        获取源图片中的人脸，结果按图片对象缓存
+        
+        参数：
+        - src_img: 源图片
+        
+        返回：
+        - 只包含特征向量的Face对象，未检测到人脸时返回None
+        
+        源图片只在界面切换时更换为新的ndarray，因此按对象身份判断是否命中缓存。
+        缓存中保留图片引用，保证对象不会被回收后复用同一个id。
+        """
+        cached_img, cached_face = self._src_cache
+        if cached_img is src_img:
+            return cached_face
+
+        src_faces = self.app.get(src_img)  # 获取源图片中的人脸信息
+        if len(src_faces) == 0:
+            logger.warning("源图片中未检测到人脸")
+            src_face = None
+        else:
+            # 换脸模型只使用源人脸的normed_embedding
+            src_face = Face(embedding=src_faces[0].embedding)
+            self._collect_calibration_sample(src_img, src_faces[0], src_face)
+        self._src_cache = (src_img, src_face)
+        return src_face
+
+    def _find_target_face(self, img):
+        """
+        获取目标图片中要替换的人脸，检测与帧间跟踪交替进行
+        
+        参数：
+        - img: 原分辨率图片
+        
+        返回：
+        - 人脸对象（bbox和kps为原图坐标），未找到时返回None
+        
+        处理流程：
+        1. 将图片缩小到DET_SIZE，检测模型内部本来就会缩放到该尺寸，
+           提前用INTER_AREA缩小可以避免高分辨率画面在检测流程中的多次全图拷贝
+        2. 距上次检测不足DET_INTERVAL帧时，用光流跟踪上一帧的关键点
+        3. 跟踪失败或到达检测间隔时重新运行检测模型（只做检测，不计算特征向量），
+           检测到多张人脸时选择与上一帧人脸IoU最大的一张，保证始终替换同一个人
+        """
+        h, w = img.shape[:2]
+        scale = min(1.0, max(DET_SIZE) / max(h, w))
+        if scale < 1.0:
+            dsize = (round(w * scale), round(h * scale))
+            small = cv2.resize(img, dsize, dst=self._small_buf, interpolation=cv2.INTER_AREA)
+            self._small_buf = small
+        else:
+            small = img
+        # 上一帧灰度图仍要用于跟踪，当前帧写入另一块缓冲区，两块交替使用
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY, dst=self._gray_buf)
+
+        face = None
+        # 检测后跟踪DET_INTERVAL-1帧，即每DET_INTERVAL帧运行一次检测
+        if (self._last_face is not None and self._frames_since_det < DET_INTERVAL - 1
+                and self._last_gray.shape == gray.shape):
+            face = self._track(gray, scale)
+        if face is None:
+            faces = self._detect(small, scale)
+            if len(faces) == 0:
+                face = None
+            elif self._last_face is not None:
+                face = max(faces, key=lambda f: self._bbox_iou(f.bbox, self._last_face.bbox))
+            else:
+                face = faces[0]
+            self._frames_since_det = 0
+        else:
+            self._frames_since_det += 1
+
+        self._last_face = face
+        self._gray_buf = self._last_gray
+        self._last_gray = gray
+        return face
+
+    def _detect(self, img, scale):
+        """
+        只运行检测模型，获取图片中的所有人脸
+        
+        参数：
+        - img: 缩小后的图片
+        - scale: img相对原图的缩放比例
+        
+        返回：
+        - 人脸对象列表（bbox和kps为原图坐标）
+        
+        换脸模型只按目标人脸的kps对齐，不需要其特征向量，因此不调用app.get，
+        每个检测帧不再对画面中的每张人脸运行识别模型
+        """
+        bboxes, kpss = self.app.det_model.detect(img, max_num=0, metric='default')
+        faces = []
+        for i in range(bboxes.shape[0]):
+            kps = kpss[i] / scale if kpss is not None else None
+            faces.append(Face(bbox=bboxes[i, 0:4] / scale, kps=kps, det_score=bboxes[i, 4]))
+        return faces
+
+    def _track(self, gray, scale):
+        """
+        用金字塔LK光流将上一帧人脸的5个关键点跟踪到当前帧
+        
+        参数：
+        - gray: 当前帧缩小后的灰度图
+        - scale: 缩小比例
+        
+        返回：
+        - 更新了bbox和kps的人脸对象，任一关键点跟踪失败时返回None
+        
+        LK的status对图像内的点几乎总是成功，因此再从当前帧反向跟踪回上一帧，
+        任一关键点往返误差超过TRACK_FB_THRESHOLD即视为漂移，交给检测模型重新定位。
+        换脸模型只根据kps计算仿射变换，更新kps即可，bbox按关键点的平均位移平移
+        """
+        last = self._last_face
+        prev_pts = (last.kps * scale).astype(np.float32).reshape(-1, 1, 2)
+        lk_params = dict(winSize=(15, 15), maxLevel=2)
+        next_pts, status, _ = cv2.calcOpticalFlowPyrLK(
+            self._last_gray, gray, prev_pts, None, **lk_params)
+        if next_pts is None or not status.all():
+            return None
+        back_pts, back_status, _ = cv2.calcOpticalFlowPyrLK(
+            gray, self._last_gray, next_pts, None, **lk_params)
+        if back_pts is None or not back_status.all():
+            return None
+        fb_error = np.linalg.norm((back_pts - prev_pts).reshape(-1, 2), axis=1)
+        if fb_error.max() > TRACK_FB_THRESHOLD:
+            return None
+
+        kps = next_pts.reshape(-1, 2) / scale
+        dx, dy = (kps - last.kps).mean(axis=0)
+        bbox = last.bbox + np.array([dx, dy, dx, dy], dtype=last.bbox.dtype)
+        return Face(bbox=bbox, kps=kps, det_score=last.det_score)
+
+    @staticmethod
+    def _bbox_iou(a, b):
+        """
+        计算两个[x1, y1, x2, y2]框的交并比
+        """
+        iw = max(0.0, min(a[2], b[2]) - max(a[0], b[0]))
+        ih = max(0.0, min(a[3], b[3]) - max(a[1], b[1]))
+        inter = iw * ih
+        union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+        return inter / union if union > 0 else 0.0
+
+    def _paste_back(self, img, bgr_fake, M):
+        """
+        将对齐后的换脸结果原地贴回原图
+        
+        参数：
+        - img: 原分辨率目标图片，人脸区域被直接改写
+        - bgr_fake: 换脸模型输出的对齐人脸（128x128）
+        - M: 对齐时使用的仿射矩阵
+        
+        返回：
+        - img本身
+        
+        遮罩生成与insightface的paste_back一致（腐蚀后高斯模糊，包括人脸靠近画面边缘时
+        的边界处理），但只在人脸所在的区域内计算，避免对整幅画面做浮点转换和变换。
+        由于变换只在区域内进行，结果与整幅画面计算相比可能有1个灰度级的舍入差异
+        """
+        h, w = img.shape[:2]
+        size = bgr_fake.shape[0]
+        IM = cv2.invertAffineTransform(M)
+
+        # 对齐人脸四个角变换回原图后的外接矩形即为需要处理的区域，
+        # 双线性插值会向外扩散约1个像素，因此四周各多留1个像素
+        corners = np.array([[0, 0], [size, 0], [0, size], [size, size]], np.float32)
+        pts = corners @ IM[:, :2].T + IM[:, 2]
+        x0, y0 = np.maximum(np.floor(pts.min(axis=0)).astype(int) - 1, 0)
+        x1, y1 = np.minimum(np.ceil(pts.max(axis=0)).astype(int) + 1, (w, h))
+        if x1 <= x0 or y1 <= y0:
+            return img
+        IM[:, 2] -= (x0, y0)
+        roi_size = (int(x1 - x0), int(y1 - y0))
+
+        warped = cv2.warpAffine(np.ascontiguousarray(bgr_fake), IM, roi_size, borderValue=0.0)
+        mask = cv2.warpAffine(np.full((size, size), 255, np.float32), IM, roi_size, borderValue=0.0)
+        mask[mask > 20] = 255
+
+        mask_h_inds, mask_w_inds = np.where(mask == 255)
+        if len(mask_h_inds) == 0:
+            return img
+        mask_h = np.max(mask_h_inds) - np.min(mask_h_inds)
+        mask_w = np.max(mask_w_inds) - np.min(mask_w_inds)
+        mask_size = int(np.sqrt(mask_h * mask_w))
+        k = max(mask_size // 10, 10)
+        # 在整幅画面上腐蚀时，区域内侧的边外是值为0的画面，画面边界处则使用默认边界
+        # （不腐蚀）。因此只在不与画面边界重合的边补0，再用默认边界腐蚀后裁回
+        top, left = (k if y0 > 0 else 0), (k if x0 > 0 else 0)
+        bottom, right = (k if y1 < h else 0), (k if x1 < w else 0)
+        mask = cv2.copyMakeBorder(mask, top, bottom, left, right, cv2.BORDER_CONSTANT, value=0)
+        mask = cv2.erode(mask, np.ones((k, k), np.uint8), iterations=1)
+        mask = mask[top:mask.shape[0] - bottom, left:mask.shape[1] - right]
+        k = max(mask_size // 20, 5)
+        mask = cv2.GaussianBlur(mask, (2 * k + 1, 2 * k + 1), 0)
+        mask /= 255
+
+        # 只改写人脸所在区域，不复制整幅画面
+        _blend(img[y0:y1, x0:x1], warped, mask)
+        return img
+
     def swap_face(self, src_img, dst_img):
         """
         执行人脸交换操作
@@ -81,17 +793,16 @@ class FaceSwapper:
         - dst_img: 目标图片（要替换的人脸）
         
         返回：
-        - 如果成功，返回换脸后的图片
-        - 如果失败，返回原始目标图片
+        - 换脸结果直接写入dst_img并返回dst_img，失败时dst_img保持不变
         
         处理流程：
         1. 检查模型是否加载完成
-        2. 检测源图片和目标图片中的人脸
+        2. 获取源人脸（有缓存时直接复用），检测目标图片中的人脸
         3. 执行人脸交换
         4. 处理各种可能的错误情况
         """
         # 检查模型是否仍在加载中
-        if self.thread.is_alive():
+        if self.is_loading():
             logger.info("模型仍在加载中...")
             return dst_img
             
@@ -101,24 +812,236 @@ class FaceSwapper:
             return dst_img
             
         try:
-            # 检测源图片和目标图片中的人脸
-            src_faces = self.app.get(src_img)  # 获取源图片中的人脸信息
-            dst_faces = self.app.get(dst_img)  # 获取目标图片中的人脸信息
-            
-            # 检查是否检测到人脸
-            if len(src_faces) == 0:
-                logger.warning("源图片中未检测到人脸")
+            if self._src_cache[0] is src_img:
+                # 源图片未变化时复用缓存的人脸特征
+                src_face = self._src_cache[1]
+                dst_face = self._find_target_face(dst_img)  # 获取目标图片中的人脸信息
+            else:
+                # 源图片更换后，源图片与目标画面的检测互不依赖，并行执行，
+                # 让一路的CPU前后处理与另一路的GPU推理重叠
+                src_future = self.executor.submit(self._get_source_face, src_img)
+                dst_face = self._find_target_face(dst_img)
+                src_face = src_future.result()
+
+            if src_face is None:
                 return dst_img
-            if len(dst_faces) == 0:
+            if dst_face is None:
                 logger.warning("目标图片中未检测到人脸")
                 return dst_img
+            if self._frames_since_det == 0:
+                # 只在完整检测的帧上收集校准样本，跟踪得到的关键点精度较低
+                self._collect_calibration_sample(dst_img, dst_face, src_face)
                 
             # 执行人脸交换
-            # 使用第一个检测到的人脸进行交换
-            # paste_back=True表示将换脸结果粘贴回原图
-            result = self.swapper.get(dst_img, dst_faces[0], src_faces[0], paste_back=True)
-            return result
+            # paste_back=False只返回对齐后的换脸结果和仿射矩阵，再由_paste_back贴回原图
+            bgr_fake, M = self.swapper.get(dst_img, dst_face, src_face, paste_back=False)
+            return self._paste_back(dst_img, bgr_fake, M)
         except Exception as e:
             # 处理换脸过程中的错误
             logger.error(f"换脸过程中出错: {str(e)}")
-            return dst_img
\ No newline at end of file
+            return dst_img
+
+
+class _ForwardHandler(logging.Handler):
+    """
+    将子进程的日志记录交给主进程中同名的logger处理，使其经过主进程已配置的处理器
+    """
+
+    def emit(self, record):
+        logging.getLogger(record.name).handle(record)
+
+
+def run_worker(shm_in_name, shm_out_name, shape, src_queue, log_queue,
+               ready_evt, done_evt, loaded_evt, stop_evt):
+    """
+    换脸子进程入口
+    
+    参数：
+    - shm_in_name: 输入帧共享内存名称
+    - shm_out_name: 输出帧共享内存名称
+    - shape: 共享的[高, 宽]数组，描述当前帧尺寸
+    - src_queue: 接收源图片的队列，只在源图片更换时发送
+    - log_queue: 转发日志记录到主进程的队列
+    - ready_evt: 主进程写入新帧后置位
+    - done_evt: 子进程写完结果后置位
+    - loaded_evt: 模型加载完成后置位
+    - stop_evt: 主进程请求退出时置位
+    
+    换脸推理、CUDA驱动调用和日志格式化都在子进程中执行，不再与界面线程争抢GIL
+    """
+    # 子进程的日志全部转发给主进程输出，避免重复打印
+    root = logging.getLogger()
+    root.handlers = [logging.handlers.QueueHandler(log_queue)]
+
+    shm_in = shared_memory.SharedMemory(name=shm_in_name)
+    shm_out = shared_memory.SharedMemory(name=shm_out_name)
+
+    swapper = FaceSwapper()
+    swapper.thread.join()
+    loaded_evt.set()
+
+    src_img = None
+    try:
+        while not stop_evt.is_set():
+            if not ready_evt.wait(0.1):
+                continue
+            ready_evt.clear()
+            # 取最新的源图片
+            while True:
+                try:
+                    src_img = src_queue.get_nowait()
+                except queue.Empty:
+                    break
+
+            h, w = shape[0], shape[1]
+            frame = np.ndarray((h, w, 3), np.uint8, buffer=shm_in.buf)
+            out = np.ndarray((h, w, 3), np.uint8, buffer=shm_out.buf)
+            # 输入只复制一次到输出共享内存，换脸结果直接融合到输出中
+            np.copyto(out, frame)
+            if src_img is not None:
+                swapper.swap_face(src_img, out)
+            del frame, out  # 释放对共享内存的引用，保证可以正常关闭
+            done_evt.set()
+    finally:
+        shm_in.close()
+        shm_out.close()
+
+
+class SwapProcess:
+    """
+    在子进程中运行FaceSwapper的代理类
+    
+    提供与FaceSwapper相同的swap_face和is_loading接口，界面和流水线代码无需区分。
+    
+    主要功能：
+    1. 创建输入、输出两块共享内存，以spawn方式启动换脸子进程
+    2. 每帧通过共享内存传递画面，通过Event通知，不经过序列化
+    3. 将子进程的日志转发到主进程的日志系统
+    """
+
+    def __init__(self):
+        """
+        创建共享内存并启动换脸子进程
+        """
+        ctx = mp.get_context('spawn')
+        self.shm_in = shared_memory.SharedMemory(create=True, size=FRAME_SHM_SIZE)
+        self.shm_out = shared_memory.SharedMemory(create=True, size=FRAME_SHM_SIZE)
+        self.shape = ctx.Array('i', 2, lock=False)
+        self.src_queue = ctx.Queue()
+        self.log_queue = ctx.Queue()
+        self.ready_evt = ctx.Event()
+        self.done_evt = ctx.Event()
+        self.loaded_evt = ctx.Event()
+        self.stop_evt = ctx.Event()
+        self._cancel_evt = Event()  # 流水线停止时置位，中断正在等待的swap_face
+        self._pending = False  # 上一帧等待超时或被取消，子进程可能仍在处理
+        self._last_src = None  # 上一次发送给子进程的源图片
+
+        self.log_listener = logging.handlers.QueueListener(self.log_queue, _ForwardHandler())
+        self.log_listener.start()
+
+        self.process = ctx.Process(
+            target=run_worker,
+            args=(self.shm_in.name, self.shm_out.name, self.shape, self.src_queue, self.log_queue,
+                  self.ready_evt, self.done_evt, self.loaded_evt, self.stop_evt))
+        self.process.daemon = True  # 主进程退出时自动结束
+        self.process.start()
+
+    def is_loading(self):
+        """
+        子进程中的模型是否仍在加载中
+        """
+        return self.process.is_alive() and not self.loaded_evt.is_set()
+
+    def cancel(self):
+        """
+        中断正在等待子进程结果的swap_face，使其立即返回未修改的画面
+        
+        流水线停止时调用，避免停止摄像头或关闭窗口时界面卡住最多SWAP_TIMEOUT秒。
+        取消请求一直有效到下次reset，流水线停止时换脸线程可能还没有进入等待
+        """
+        self._cancel_evt.set()
+
+    def reset(self):
+        """
+        清除取消请求，流水线启动时调用
+        
+        停止时可能没有正在等待的swap_face（如关闭了人脸检测），
+        不清除的话重新启动后的第一帧会被当作已取消
+        """
+        self._cancel_evt.clear()
+
+    def swap_face(self, src_img, dst_img):
+        """
+        在子进程中执行人脸交换
+        
+        参数：
+        - src_img: 源图片（要交换的人脸）
+        - dst_img: 目标图片（要替换的人脸）
+        
+        返回：
+        - 换脸结果直接写回dst_img并返回，失败时返回未修改的dst_img
+        
+        上一帧超时后子进程可能仍在读取输入共享内存，此时写入新帧会得到错乱的结果，
+        而它稍后置位的done_evt也会被当成新帧的结果。因此在上一帧完成之前直接跳过，
+        完成后丢弃其结果再发送新帧
+        """
+        if self.is_loading():
+            logger.info("模型仍在加载中...")
+            return dst_img
+        if not self.process.is_alive():
+            logger.error("换脸进程已退出")
+            return dst_img
+
+        h, w = dst_img.shape[:2]
+        if dst_img.nbytes > FRAME_SHM_SIZE:
+            logger.warning(f"画面尺寸超出共享内存容量: {w}x{h}")
+            return dst_img
+
+        # 源图片只在更换时发送
+        if src_img is not self._last_src:
+            self.src_queue.put(src_img)
+            self._last_src = src_img
+
+        if self._pending:
+            if not self.done_evt.is_set():
+                return dst_img
+            self._pending = False
+
+        np.copyto(np.ndarray((h, w, 3), np.uint8, buffer=self.shm_in.buf), dst_img)
+        self.shape[0], self.shape[1] = h, w
+        self.done_evt.clear()
+        self.ready_evt.set()
+        if not self._wait_done():
+            self._pending = True
+            return dst_img
+        np.copyto(dst_img, np.ndarray((h, w, 3), np.uint8, buffer=self.shm_out.buf))
+        return dst_img
+
+    def _wait_done(self):
+        """
+        分段等待子进程完成当前帧，期间响应cancel请求
+        
+        返回：
+        - True表示结果已写入输出共享内存，超时或被取消时返回False
+        """
+        for _ in range(int(SWAP_TIMEOUT / SWAP_POLL_INTERVAL)):
+            if self._cancel_evt.is_set():
+                return False
+            if self.done_evt.wait(SWAP_POLL_INTERVAL):
+                return True
+        logger.warning("换脸进程响应超时")
+        return False
+
+    def close(self):
+        """
+        停止子进程并释放共享内存
+        """
+        self.stop_evt.set()
+        self.process.join(timeout=2)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.log_listener.stop()
+        for shm in (self.shm_in, self.shm_out):
+            shm.close()
+            shm.unlink()
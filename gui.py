@@ -1,33 +1,37 @@
 import sys
 import cv2
+import numpy as np
 import time
 import glob
-from PyQt5.QtCore import Qt, QTimer, pyqtSignal, QObject
+from PyQt5.QtCore import Qt, QTimer
 from PyQt5.QtGui import QImage, QPixmap, QFont, QPalette, QColor, QIcon
 from PyQt5.QtWidgets import (QApplication, QWidget, QLabel, QHBoxLayout,
                            QVBoxLayout, QMessageBox, QFrame, QStatusBar,
                            QProgressBar, QPushButton, QGroupBox,
                            QGridLayout, QSpinBox, QCheckBox, QComboBox,
                            QFileDialog)
-from face_swap import FaceSwapper
-from threading import Lock
+from face_swap import SwapProcess
+from threading import Thread
+import queue
 import os
 import logging
 
+logger = logging.getLogger(__name__)
 
-class LogHandler(QObject):
+
+class LogHandler:
     """
     自定义日志处理器，用于将日志信息转发到GUI界面显示
     
     功能：
     1. 捕获日志信息
-    2. 通过信号机制将日志信息发送到GUI界面
+    2. 将日志信息放入队列，由界面定时批量取出，避免每条日志都跨线程发送信号
     3. 支持不同级别的日志显示（INFO、WARNING、ERROR）
     """
-    log_signal = pyqtSignal(str, str)  # 定义信号，参数为消息内容和日志级别
+    QUEUE_SIZE = 256
 
     def __init__(self):
-        super().__init__()
+        self.queue = queue.Queue(maxsize=self.QUEUE_SIZE)  # (消息内容, 日志级别)
         # 创建日志处理器并设置格式
         self.handler = logging.StreamHandler()
         self.handler.setFormatter(logging.Formatter('%(levelname)s: %(message)s'))
@@ -36,13 +40,191 @@ class LogHandler(QObject):
 
     def emit_log(self, record):
         """
-        重写日志处理器的emit方法，将日志信息通过信号发送
+        重写日志处理器的emit方法，将日志信息放入队列
         
         参数：
         - record: 日志记录对象，包含日志信息和级别
+        
+        队列已满说明界面处理不过来，直接丢弃该条日志
         """
         msg = self.handler.format(record)
-        self.log_signal.emit(msg, record.levelname)
+        try:
+            self.queue.put_nowait((msg, record.levelname))
+        except queue.Full:
+            pass
+
+
+class SwapPipeline:
+    """
+    采集-换脸-显示三级流水线
+    
+    功能：
+    1. 采集线程读取摄像头画面放入raw_q
+    2. 换脸线程从raw_q取帧换脸后放入swapped_q
+    3. 界面线程通过定时器从swapped_q非阻塞地取最新结果显示
+    
+    各级并行执行，吞吐量取决于最慢的一级而不是各级耗时之和。
+    队列容量为2，下游处理不过来时丢弃最旧的帧，避免延迟累积。
+    采集使用预分配的帧缓冲区，不再每帧申请新内存。空闲缓冲区放在free_bufs中，
+    采集时取出，帧被丢弃或显示完成后放回，任何一级持有的缓冲区都不会被覆盖写入。
+    """
+    QUEUE_SIZE = 2
+    # 帧缓冲区数量：两个队列中的帧 + 正在采集、换脸、显示的各一帧，
+    # 正常情况下不会出现没有空闲缓冲区的情况，换脸或显示卡住时采集线程丢帧
+    NUM_FRAME_BUFS = QUEUE_SIZE * 2 + 3
+    # 读取失败后的等待时间（秒），避免摄像头断开时空转占满CPU
+    CAPTURE_RETRY_DELAY = 0.01
+    # 连续读取失败多少次后停止采集（约1秒）
+    MAX_CAPTURE_FAILURES = 100
+
+    def __init__(self, cap, swapper):
+        """
+        参数：
+        - cap: 已打开的cv2.VideoCapture对象
+        - swapper: SwapProcess对象（或接口相同的FaceSwapper对象）
+        """
+        self.cap = cap
+        self.swapper = swapper
+        self.src_img = None  # 当前源图片，由界面线程更新
+        self.detection_enabled = True  # 是否启用人脸检测，由界面线程更新
+        self.running = False
+        self.capture_failed = False  # 摄像头连续读取失败，采集线程已退出
+        self.frame_ms = 30.0  # 相邻两个处理结果的间隔的指数移动平均（毫秒）
+        self.raw_q = queue.Queue(maxsize=self.QUEUE_SIZE)  # 采集 -> 换脸
+        self.swapped_q = queue.Queue(maxsize=self.QUEUE_SIZE)  # 换脸 -> 显示
+        self.threads = []
+        w = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        h = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.free_bufs = queue.Queue()  # 空闲的帧缓冲区
+        for _ in range(self.NUM_FRAME_BUFS):
+            self.free_bufs.put_nowait(np.empty((h, w, 3), np.uint8))
+
+    def start(self):
+        """
+        启动采集线程和换脸线程
+        """
+        self.running = True
+        self.swapper.reset()
+        self.threads = [Thread(target=self._capture_loop, daemon=True),
+                        Thread(target=self._swap_loop, daemon=True)]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        """
+        停止流水线并等待线程退出
+        
+        先取消换脸线程中正在等待的swap_face，使其不必等到超时才退出
+        """
+        self.running = False
+        self.swapper.cancel()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def release_frame(self, buf):
+        """
+        归还帧缓冲区，之后采集线程可以再次写入
+        
+        参数：
+        - buf: get_latest返回的画面
+        """
+        self.free_bufs.put_nowait(buf)
+
+    @staticmethod
+    def _put_latest(q, item, on_drop):
+        """
+        放入队列，队列已满时丢弃最旧的一项
+        
+        参数：
+        - on_drop: 丢弃某一项时调用，用于归还其帧缓冲区
+        """
+        while True:
+            try:
+                q.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    on_drop(q.get_nowait())
+                except queue.Empty:
+                    pass
+
+    def _capture_loop(self):
+        """
+        采集线程：持续读取摄像头画面，写入空闲的帧缓冲区
+        
+        没有空闲缓冲区时说明下游全部卡住，丢弃这一帧
+        """
+        failures = 0
+        while self.running:
+            ret = self.cap.grab()
+            if ret:
+                try:
+                    buf = self.free_bufs.get_nowait()
+                except queue.Empty:
+                    time.sleep(self.CAPTURE_RETRY_DELAY)
+                    continue
+                ret, frame = self.cap.retrieve(buf)
+                if not ret:
+                    self.release_frame(buf)
+            if not ret:
+                failures += 1
+                if failures >= self.MAX_CAPTURE_FAILURES:
+                    logger.error("摄像头读取失败，已停止采集")
+                    self.capture_failed = True
+                    return
+                time.sleep(self.CAPTURE_RETRY_DELAY)
+                continue
+            failures = 0
+            # 分辨率与缓冲区不一致时OpenCV会返回新数组，用它替换原缓冲区供之后复用
+            self._put_latest(self.raw_q, frame, self.release_frame)
+
+    def _swap_loop(self):
+        """
+        换脸线程：对采集到的画面执行换脸，并附带状态信息
+        
+        swap_face直接在帧缓冲区上融合换脸结果，缓冲区随结果交给界面线程。
+        无论是否换脸都统计结果的产出间隔，界面据此调整取结果的频率
+        """
+        last_put = time.perf_counter()
+        while self.running:
+            try:
+                frame = self.raw_q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+            src_img = self.src_img
+            if self.detection_enabled and src_img is not None:
+                self.swapper.swap_face(src_img, frame)
+                status, color = "检测到人脸", "#4CAF50"
+            elif src_img is None:
+                status, color = "请选择源图片", "#888888"
+            else:
+                status, color = "人脸检测已禁用", "#888888"
+            self._put_latest(self.swapped_q, (frame, status, color),
+                             lambda dropped: self.release_frame(dropped[0]))
+            now = time.perf_counter()
+            self.frame_ms = 0.9 * self.frame_ms + 0.1 * (now - last_put) * 1000
+            last_put = now
+
+    def get_latest(self):
+        """
+        取出最新的处理结果，不阻塞，可在界面线程中调用
+        
+        显示完成后需要调用release_frame归还缓冲区，跳过的旧结果在这里直接归还
+        
+        返回：
+        - (画面, 状态文本, 状态颜色)，没有新结果时返回None
+        """
+        item = None
+        while True:
+            try:
+                newer = self.swapped_q.get_nowait()
+            except queue.Empty:
+                return item
+            if item is not None:
+                self.release_frame(item[0])
+            item = newer
 
 
 class FaceSwapUI(QWidget):
@@ -55,33 +237,44 @@ class FaceSwapUI(QWidget):
     3. 提供控制选项（分辨率、人脸检测等）
     4. 显示性能监控信息
     """
+    # 摄像头画面的显示尺寸（宽, 高）
+    DISPLAY_SIZE = (800, 600)
     
     def __init__(self):
         super().__init__()
         # 初始化人脸交换器
-        self.swapper = FaceSwapper()
+        self.swapper = SwapProcess()
         # 存储源图片
         self.src_img = None
         self.src_images = {}  # 存储所有源图片
         self.current_src_index = 0
-        # 线程锁，用于保护共享资源
-        self.lock = Lock()
         # 摄像头相关变量
         self.cap = None
-        self.timer = None
+        self.pipeline = None  # 采集-换脸流水线
+        self.render_timer = None  # 显示定时器
+        # 摄像头画面BGR转RGB的复用缓冲区，按显示区域最大尺寸一次性分配，之后不再重新分配。
+        # QPixmap可能直接引用该缓冲区，因此只供摄像头画面使用
+        self._rgb_buf = np.empty(self.DISPLAY_SIZE[1] * self.DISPLAY_SIZE[0] * 3, np.uint8)
+        # 缩放到显示尺寸的复用缓冲区，按需分配
+        self._display_buf = None
         # 性能监控变量
         self.fps = 0
         self.frame_count = 0
         self.last_time = time.time()
         self.is_running = True
+        # 上一次显示的摄像头状态，状态不变时不重复设置样式
+        self._last_status = None
 
         # 设置日志处理器
         self.log_handler = LogHandler()
-        self.log_handler.log_signal.connect(self.handle_log)
         logging.getLogger().addHandler(self.log_handler.handler)
 
         # 初始化界面
         self.init_ui()
+        # 每100毫秒批量处理一次日志
+        self.log_timer = QTimer(self)
+        self.log_timer.timeout.connect(self._drain_logs)
+        self.log_timer.start(100)
         # 延迟1秒后初始化摄像头，等待模型加载
         QTimer.singleShot(1000, self.init_camera)
 
@@ -204,6 +397,7 @@ class FaceSwapUI(QWidget):
         # 人脸检测开关
         self.face_detection_check = QCheckBox("启用人脸检测")
         self.face_detection_check.setChecked(True)
+        self.face_detection_check.toggled.connect(self.toggle_face_detection)
         settings_layout.addWidget(self.face_detection_check, 0, 0, 1, 2)
 
         # 质量调节
@@ -415,6 +609,18 @@ class FaceSwapUI(QWidget):
             self.src_label.setPixmap(src_pixmap.scaled(600, 450, Qt.KeepAspectRatio))
             self.src_status.setText("等待检测人脸...")
             self.src_status.setStyleSheet("color: #888888;")
+            if self.pipeline:
+                self.pipeline.src_img = self.src_img
+
+    def toggle_face_detection(self, checked):
+        """
+        切换人脸检测开关，同步到流水线
+        
+        参数：
+        - checked: 复选框是否选中
+        """
+        if self.pipeline:
+            self.pipeline.detection_enabled = checked
 
     def toggle_camera(self):
         """
@@ -439,44 +645,101 @@ class FaceSwapUI(QWidget):
         功能：
         1. 初始化摄像头
         2. 设置分辨率
-        3. 启动定时器更新画面
+        3. 启动采集-换脸流水线和显示定时器
         4. 更新状态信息
         """
         try:
-            self.cap = cv2.VideoCapture(0)
+            self.cap = cv2.VideoCapture(0, self.camera_backend())
+            if not self.cap.isOpened():
+                # 指定后端不可用时回退到OpenCV默认后端
+                self.cap = cv2.VideoCapture(0)
             if not self.cap.isOpened():
                 QMessageBox.critical(self, "错误", "无法打开摄像头")
                 return
 
+            # 使用MJPG压缩格式传输，高分辨率下帧率更高、USB带宽更低，必须在设置分辨率之前设置
+            self.cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'MJPG'))
+            # 驱动只缓存一帧，避免读到积压的旧画面
+            self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
             # 设置分辨率
             resolution = self.resolution_combo.currentText().split('x')
             self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, int(resolution[0]))
             self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, int(resolution[1]))
 
-            self.timer = QTimer(self)
-            self.timer.timeout.connect(self.update_frame)
-            self.timer.start(30)
+            self.pipeline = SwapPipeline(self.cap, self.swapper)
+            self.pipeline.src_img = self.src_img
+            self.pipeline.detection_enabled = self.face_detection_check.isChecked()
+            self.pipeline.start()
+
+            # 显示定时器只负责取结果和绘制，不做任何耗时处理
+            self.render_timer = QTimer(self)
+            self.render_timer.timeout.connect(self.update_frame)
+            self.render_timer.start(int(self.pipeline.frame_ms / 2))
             self.is_running = True
             self.status_bar.showMessage("摄像头已启动")
         except Exception as e:
             QMessageBox.critical(self, "错误", f"摄像头初始化失败: {str(e)}")
 
+    @staticmethod
+    def camera_backend():
+        """
+        根据平台选择摄像头采集后端
+        
+        返回：
+        - Windows使用DirectShow，Linux使用V4L2，其他平台使用OpenCV默认后端
+        """
+        if sys.platform == 'win32':
+            return cv2.CAP_DSHOW
+        if sys.platform.startswith('linux'):
+            return cv2.CAP_V4L2
+        return cv2.CAP_ANY
+
     def stop_camera(self):
         """
         停止摄像头
         
         功能：
-        1. 释放摄像头资源
-        2. 停止定时器
+        1. 停止显示定时器和流水线
+        2. 释放摄像头资源
         3. 更新状态信息
         """
+        if self.render_timer:
+            self.render_timer.stop()
+            self.render_timer = None
+        # 先停止流水线，再释放摄像头，避免采集线程仍在读取
+        if self.pipeline:
+            self.pipeline.stop()
+            self.pipeline = None
         if self.cap and self.cap.isOpened():
             self.cap.release()
-        if self.timer:
-            self.timer.stop()
         self.is_running = False
         self.status_bar.showMessage("摄像头已停止")
 
+    def _drain_logs(self, max_records=32):
+        """
+        批量处理队列中的日志
+        
+        参数：
+        - max_records: 每次最多处理的日志条数
+        
+        状态栏只显示最新的一条INFO/WARNING日志，ERROR日志每次最多弹出一个警告框
+        """
+        latest_status = None
+        latest_error = None
+        for _ in range(max_records):
+            try:
+                message, level = self.log_handler.queue.get_nowait()
+            except queue.Empty:
+                break
+            if level == "ERROR":
+                latest_error = (message, level)
+            else:
+                latest_status = (message, level)
+        if latest_status:
+            self.handle_log(*latest_status)
+        if latest_error:
+            self.handle_log(*latest_error)
+
     def handle_log(self, message, level):
         """
         处理日志信息
@@ -507,7 +770,7 @@ class FaceSwapUI(QWidget):
         2. 如果未完成，显示进度条
         3. 如果完成，隐藏进度条和加载提示
         """
-        if self.swapper.thread.is_alive():
+        if self.swapper.is_loading():
             self.progress_bar.show()
             self.progress_bar.setValue(50)
             QTimer.singleShot(500, self.init_camera)
@@ -518,57 +781,70 @@ class FaceSwapUI(QWidget):
 
     def update_frame(self):
         """
-        更新摄像头画面
+        显示流水线处理好的最新画面
         
         功能：
-        1. 读取摄像头画面
-        2. 计算FPS
-        3. 如果启用了人脸检测且有源图片，执行换脸
-        4. 更新显示画面
+        1. 摄像头读取失败时停止摄像头，按结果产出间隔调整定时器间隔
+        2. 从流水线取出最新结果，没有新结果时直接返回
+        3. 计算FPS
+        4. 更新状态信息和显示画面
         """
-        if not self.cap or not self.cap.isOpened():
+        if not self.pipeline:
             return
-
-        ret, frame = self.cap.read()
-        if not ret:
+        if self.pipeline.capture_failed:
+            self.stop_camera()
+            self.start_button.setText("开始")
+            return
+        # 定时器间隔跟随结果的实际产出间隔（关闭换脸时即摄像头帧率），避免在没有新结果时空转；
+        # 取间隔的一半轮询，新结果最多等待半个间隔就会显示
+        self.render_timer.setInterval(int(max(5, self.pipeline.frame_ms / 2)))
+        item = self.pipeline.get_latest()
+        if item is None:
             return
+        frame, status, color = item
+        display_frame = frame
 
         # 计算FPS
         self.frame_count += 1
         current_time = time.time()
         if current_time - self.last_time >= 1.0:
+            # FPS数值变化时才更新标签
+            if self.frame_count != self.fps:
+                self.fps_label.setText(f"FPS: {self.frame_count}")
             self.fps = self.frame_count
             self.frame_count = 0
             self.last_time = current_time
-            self.fps_label.setText(f"FPS: {self.fps}")
-
-        if self.lock.acquire(blocking=False):
-            try:
-                if self.face_detection_check.isChecked() and self.src_img is not None:
-                    result = self.swapper.swap_face(self.src_img, frame)
-                    display_frame = result if result is not None else frame
-                    
-                    # 更新状态信息
-                    if result is not None:
-                        self.cam_status.setText("检测到人脸")
-                        self.cam_status.setStyleSheet("color: #4CAF50;")
-                    else:
-                        self.cam_status.setText("未检测到人脸")
-                        self.cam_status.setStyleSheet("color: #f44336;")
-                else:
-                    display_frame = frame
-                    if self.src_img is None:
-                        self.cam_status.setText("请选择源图片")
-                    else:
-                        self.cam_status.setText("人脸检测已禁用")
-                    self.cam_status.setStyleSheet("color: #888888;")
-            finally:
-                self.lock.release()
-        else:
-            display_frame = frame
 
-        pixmap = self.cv2_to_pixmap(display_frame)
-        self.cam_label.setPixmap(pixmap.scaled(800, 600, Qt.KeepAspectRatio))
+        # 更新状态信息
+        self._set_status(status, color)
+
+        # 先用OpenCV缩放到显示尺寸，再做颜色转换，减少需要处理的像素
+        h, w = display_frame.shape[:2]
+        tw, th = self.fit_size(w, h, *self.DISPLAY_SIZE)
+        if (tw, th) != (w, h):
+            display_frame = cv2.resize(display_frame, (tw, th), dst=self._display_buf,
+                                       interpolation=cv2.INTER_LINEAR)
+            # 尺寸变化时OpenCV会返回新数组，之后复用该数组
+            self._display_buf = display_frame
+        self.cam_label.setPixmap(self.frame_to_pixmap(display_frame))
+        # QPixmap已复制画面数据，缓冲区可以交还给采集线程
+        self.pipeline.release_frame(frame)
+
+    def _set_status(self, text, color):
+        """
+        更新摄像头状态标签
+        
+        参数：
+        - text: 状态文本
+        - color: 状态文本颜色
+        
+        与上一次状态相同时直接返回，避免每帧重新解析样式表和重新布局
+        """
+        if (text, color) == self._last_status:
+            return
+        self._last_status = (text, color)
+        self.cam_status.setText(text)
+        self.cam_status.setStyleSheet(f"color: {color};")
 
     def closeEvent(self, event):
         """
@@ -576,11 +852,28 @@ class FaceSwapUI(QWidget):
         
         功能：
         1. 停止摄像头
-        2. 接受关闭事件
+        2. 停止换脸进程并释放共享内存
+        3. 接受关闭事件
         """
         self.stop_camera()
+        self.swapper.close()
         event.accept()
 
+    @staticmethod
+    def fit_size(w, h, max_w, max_h):
+        """
+        计算保持宽高比缩放到指定区域内的尺寸，与Qt.KeepAspectRatio一致
+        
+        参数：
+        - w, h: 原始宽高
+        - max_w, max_h: 显示区域宽高
+        
+        返回：
+        - (宽, 高)
+        """
+        scale = min(max_w / w, max_h / h)
+        return max(1, round(w * scale)), max(1, round(h * scale))
+
     def cv2_to_pixmap(self, frame):
         """
         将OpenCV图像转换为QPixmap
@@ -589,7 +882,7 @@ class FaceSwapUI(QWidget):
         - frame: OpenCV图像
         
         返回：
-        - QPixmap对象
+        - QPixmap对象（转换为系统像素格式，数据与frame无关）
         """
         if frame is None:
             return QPixmap()
@@ -598,6 +891,29 @@ class FaceSwapUI(QWidget):
         qimg = QImage(frame.data, w, h, bytes_per_line, QImage.Format_BGR888)
         return QPixmap.fromImage(qimg)
 
+    def frame_to_pixmap(self, frame):
+        """
+        将缩放到显示尺寸的摄像头画面转换为QPixmap
+        
+        参数：
+        - frame: 不超过DISPLAY_SIZE的OpenCV图像
+        
+        返回：
+        - QPixmap对象
+        
+        颜色转换写入复用的RGB缓冲区，QImage直接引用该缓冲区，
+        以RGB888格式创建QPixmap时不再需要额外的格式转换。
+        此时QPixmap可能与缓冲区共享内存，下一帧写入缓冲区后立即替换显示的QPixmap，
+        两者都在界面线程中执行；缓冲区不会重新分配，不会出现引用已释放内存的情况
+        """
+        h, w, c = frame.shape
+        # 取缓冲区开头的连续内存作为h×w×3的视图
+        rgb = self._rgb_buf[:h * w * 3].reshape(h, w, 3)
+        cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=rgb)
+        bytes_per_line = 3 * w
+        qimg = QImage(rgb.data, w, h, bytes_per_line, QImage.Format_RGB888)
+        return QPixmap.fromImage(qimg, Qt.NoFormatConversion)
+
 
 if __name__ == "__main__":
     """
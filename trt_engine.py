@@ -0,0 +1,265 @@
+import ctypes
+import logging
+import os
+import re
+
+import numpy as np
+
+# TensorRT为可选依赖，未安装时由调用方回退到ONNX Runtime推理
+try:
+    import tensorrt as trt
+    from cuda import cudart
+except ImportError:
+    trt = None
+    cudart = None
+
+logger = logging.getLogger(__name__)
+
+TRT_LOGGER = trt.Logger(trt.Logger.WARNING) if trt is not None else None
+
+
+def is_available():
+    """
+    检查TensorRT及CUDA运行时是否可用
+
+    返回：
+    - True表示可以构建和加载TensorRT引擎
+    """
+    return trt is not None and cudart is not None
+
+
+def engine_tag():
+    """
+    返回标识当前TensorRT版本和GPU型号的字符串，用于引擎文件名
+    
+    序列化的引擎只能在构建时的TensorRT版本和GPU型号上反序列化，
+    文件名中包含这两项，升级TensorRT或更换GPU后会自动构建新的引擎
+    
+    返回：
+    - 例如"trt8.6.1_NVIDIA_GeForce_RTX_3060"
+    """
+    props = _check(cudart.cudaGetDeviceProperties(0))
+    name = props.name
+    if isinstance(name, bytes):
+        name = name.split(b'\0', 1)[0].decode(errors='ignore')
+    name = re.sub(r'[^0-9A-Za-z]+', '_', name).strip('_')
+    return f"trt{trt.__version__}_{name}"
+
+
+def _check(result):
+    """
+    检查cuda-python接口的返回值
+
+    cuda-python的接口统一返回(错误码, 返回值...)元组，出错时抛出RuntimeError
+
+    返回：
+    - 去掉错误码后的返回值（无返回值时为None）
+    """
+    err, *values = result
+    if err != cudart.cudaError_t.cudaSuccess:
+        raise RuntimeError(f"CUDA调用失败: {cudart.cudaGetErrorName(err)[1]}")
+    if not values:
+        return None
+    return values[0] if len(values) == 1 else values
+
+
+def _static_shape(shape):
+    """
+    将动态维度（-1）固定为1，得到构建和推理时使用的静态形状
+
+    inswapper_128只处理单张对齐后的人脸，批大小固定为1
+    """
+    return tuple(d if d > 0 else 1 for d in shape)
+
+
+def build_engine(onnx_path, engine_path, calibrator=None):
+    """
+    将ONNX模型构建为TensorRT引擎并序列化到磁盘
+
+    参数：
+    - onnx_path: ONNX模型路径
+    - engine_path: 引擎缓存路径
+    - calibrator: INT8校准器，为None时构建FP16引擎，否则构建INT8引擎
+      （不适合量化的层仍使用FP16）
+
+    构建耗时较长（通常数十秒到数分钟），只在引擎缓存不存在时执行一次
+    """
+    builder = trt.Builder(TRT_LOGGER)
+    flags = 0
+    if hasattr(trt.NetworkDefinitionCreationFlag, 'EXPLICIT_BATCH'):
+        flags = 1 << int(trt.NetworkDefinitionCreationFlag.EXPLICIT_BATCH)
+    network = builder.create_network(flags)
+    parser = trt.OnnxParser(network, TRT_LOGGER)
+    with open(onnx_path, 'rb') as f:
+        if not parser.parse(f.read()):
+            errors = [str(parser.get_error(i)) for i in range(parser.num_errors)]
+            raise RuntimeError(f"ONNX模型解析失败: {'; '.join(errors)}")
+
+    config = builder.create_builder_config()
+    config.set_flag(trt.BuilderFlag.FP16)
+
+    # 固定输入形状，例如target为(1,3,128,128)
+    profile = builder.create_optimization_profile()
+    for i in range(network.num_inputs):
+        tensor = network.get_input(i)
+        shape = _static_shape(tensor.shape)
+        profile.set_shape(tensor.name, shape, shape, shape)
+    config.add_optimization_profile(profile)
+    if calibrator is not None:
+        config.set_flag(trt.BuilderFlag.INT8)
+        config.int8_calibrator = calibrator
+        config.set_calibration_profile(profile)
+
+    serialized = builder.build_serialized_network(network, config)
+    if serialized is None:
+        raise RuntimeError("TensorRT引擎构建失败")
+    with open(engine_path, 'wb') as f:
+        f.write(serialized)
+    logger.info(f"TensorRT引擎已保存: {engine_path}")
+
+
+if trt is not None:
+    class Int8Calibrator(trt.IInt8EntropyCalibrator2):
+        """
+        INT8熵校准器
+
+        逐个读取校准目录中的.npz样本（每个样本包含各输入名称对应的数组），
+        拷贝到显存后交给TensorRT统计激活值分布。
+        校准结果缓存到磁盘，重新构建引擎时不需要再次读取样本。
+        """
+
+        def __init__(self, files, cache_path):
+            """
+            参数：
+            - files: 校准样本文件路径列表
+            - cache_path: 校准缓存文件路径
+            """
+            trt.IInt8EntropyCalibrator2.__init__(self)
+            self.files = list(files)
+            self.cache_path = cache_path
+            self.index = 0
+            self.device = {}  # 输入名称 -> 显存指针
+
+        def get_batch_size(self):
+            return 1
+
+        def get_batch(self, names):
+            """
+            返回下一个样本各输入的显存地址，样本用完时返回None
+            """
+            if self.index >= len(self.files):
+                return None
+            with np.load(self.files[self.index]) as sample:
+                for name in names:
+                    data = np.ascontiguousarray(sample[name], dtype=np.float32)
+                    if name not in self.device:
+                        self.device[name] = _check(cudart.cudaMalloc(data.nbytes))
+                    _check(cudart.cudaMemcpy(self.device[name], data.ctypes.data, data.nbytes,
+                                             cudart.cudaMemcpyKind.cudaMemcpyHostToDevice))
+            self.index += 1
+            return [int(self.device[name]) for name in names]
+
+        def read_calibration_cache(self):
+            if os.path.exists(self.cache_path):
+                with open(self.cache_path, 'rb') as f:
+                    return f.read()
+            return None
+
+        def write_calibration_cache(self, cache):
+            with open(self.cache_path, 'wb') as f:
+                f.write(cache)
+
+
+class TRTSession:
+    """
+    TensorRT引擎推理会话
+
+    提供与onnxruntime.InferenceSession相同的run接口，
+    可以直接替换insightface模型对象上的session属性
+
+    主要功能：
+    1. 反序列化引擎并创建执行上下文
+    2. 一次性分配锁页内存和显存缓冲区，每帧复用
+    3. 通过异步拷贝和execute_v2执行推理
+    """
+
+    def __init__(self, engine_path):
+        """
+        加载TensorRT引擎
+
+        参数：
+        - engine_path: build_engine生成的引擎文件路径
+        """
+        self.runtime = trt.Runtime(TRT_LOGGER)
+        with open(engine_path, 'rb') as f:
+            self.engine = self.runtime.deserialize_cuda_engine(f.read())
+        if self.engine is None:
+            raise RuntimeError(f"TensorRT引擎反序列化失败: {engine_path}")
+        self.context = self.engine.create_execution_context()
+        self.stream = _check(cudart.cudaStreamCreate())
+
+        self.input_names = []
+        self.output_names = []
+        self.host = {}  # 锁页内存缓冲区（ndarray视图）
+        self.device = {}  # 显存指针
+        self.nbytes = {}
+
+        names = [self.engine.get_tensor_name(i) for i in range(self.engine.num_io_tensors)]
+        # 先确定输入形状，输出形状依赖于输入形状
+        for name in names:
+            if self.engine.get_tensor_mode(name) == trt.TensorIOMode.INPUT:
+                self.context.set_input_shape(name, _static_shape(self.engine.get_tensor_shape(name)))
+                self.input_names.append(name)
+            else:
+                self.output_names.append(name)
+        for name in names:
+            self._allocate(name, tuple(self.context.get_tensor_shape(name)))
+        # execute_v2按引擎I/O张量顺序接收显存地址
+        self.bindings = [self.device[name] for name in names]
+
+    def _allocate(self, name, shape):
+        """
+        为一个I/O张量分配锁页内存和显存
+        """
+        dtype = np.dtype(trt.nptype(self.engine.get_tensor_dtype(name)))
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        host_ptr = _check(cudart.cudaMallocHost(nbytes))
+        buf = (ctypes.c_byte * nbytes).from_address(host_ptr)
+        self.host[name] = np.frombuffer(buf, dtype=dtype).reshape(shape)
+        self.device[name] = _check(cudart.cudaMalloc(nbytes))
+        self.nbytes[name] = nbytes
+
+    def get_providers(self):
+        """
+        返回推理后端名称，与InferenceSession.get_providers保持一致
+        """
+        return ['TensorRT']
+
+    def run(self, output_names, input_feed):
+        """
+        执行一次推理
+
+        参数：
+        - output_names: 需要返回的输出名称列表，为None时返回全部输出
+        - input_feed: 输入名称到ndarray的字典
+
+        返回：
+        - 与output_names顺序一致的输出ndarray列表
+        """
+        for name in self.input_names:
+            np.copyto(self.host[name], input_feed[name])
+            _check(cudart.cudaMemcpyAsync(self.device[name], self.host[name].ctypes.data,
+                                          self.nbytes[name],
+                                          cudart.cudaMemcpyKind.cudaMemcpyHostToDevice,
+                                          self.stream))
+        _check(cudart.cudaStreamSynchronize(self.stream))
+        if not self.context.execute_v2(self.bindings):
+            raise RuntimeError("TensorRT推理失败")
+        for name in self.output_names:
+            _check(cudart.cudaMemcpyAsync(self.host[name].ctypes.data, self.device[name],
+                                          self.nbytes[name],
+                                          cudart.cudaMemcpyKind.cudaMemcpyDeviceToHost,
+                                          self.stream))
+        _check(cudart.cudaStreamSynchronize(self.stream))
+        # 返回副本，避免调用方持有的结果被下一帧覆盖
+        return [self.host[name].copy() for name in (output_names or self.output_names)]